@@ -0,0 +1,343 @@
+"""
+Shared helpers for the Contextual AI user management scripts.
+
+Holds the API key lookup, HTTP session, rate-limit handling, CSV reader and
+NDJSON writer used by both invite_users.py and remove_users.py. Not meant
+to be run directly.
+"""
+
+import collections
+import csv
+import gzip
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional, TextIO
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+except ImportError:
+    print("Error: requests library required. Install with: pip install requests")
+    sys.exit(1)
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass  # dotenv is optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # orjson is optional, falls back to stdlib json
+
+
+API_BASE_URL = "https://api.contextual.ai/v1"
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+# Auto-detected email column names, in order of preference, compared after
+# lowercasing and dropping spaces/punctuation ("E-Mail", "Email Address", ...)
+EMAIL_COLUMN_NAMES = ("email", "emailaddress")
+POOL_MAXSIZE = 32
+
+# Rate-limit handling: retry throttled calls with exponential backoff, and
+# adapt concurrency (halve on throttle, +1 after a run of successes)
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+RETRY_STATUSES = {429, 503}
+INCREASE_AFTER = 5
+
+SESSIONS: dict[str, requests.Session] = {}
+RATE_LIMITER: Optional["RateLimiter"] = None
+
+# Set while the API is throttling us; requests then go through THROTTLE_LOCK
+# one at a time until a success clears it
+THROTTLED = threading.Event()
+THROTTLE_LOCK = threading.Lock()
+
+
+def get_api_key() -> str:
+    """Get API key from environment variable."""
+    api_key = os.environ.get("CONTEXTUAL_API_KEY")
+    if not api_key:
+        print("Error: CONTEXTUAL_API_KEY environment variable not set")
+        print("Set it with: export CONTEXTUAL_API_KEY='your-key'")
+        sys.exit(1)
+    return api_key
+
+
+def get_session(api_key: str) -> requests.Session:
+    """
+    Get a shared HTTP session so all calls reuse the same keep-alive connection.
+
+    Sessions are kept per API key, so a call with a different key never
+    sends another key's Authorization header.
+
+    Args:
+        api_key: Contextual AI API key
+
+    Returns:
+        A requests.Session with auth headers and retrying adapter mounted
+        (rate-limit statuses are handled by send_with_retry instead)
+    """
+    session = SESSIONS.get(api_key)
+    if session is None:
+        session = requests.Session()
+        session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[502, 504]
+        )
+        session.mount(
+            "https://",
+            HTTPAdapter(pool_connections=16, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+        )
+        SESSIONS[api_key] = session
+    return session
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD controller for the number of requests allowed in flight.
+
+    The limit is halved whenever the API throttles us and grows by one
+    after every INCREASE_AFTER consecutive successes, up to max_limit.
+    """
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.in_flight = 0
+        self.successes = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        """Block until another request may be sent under the current limit."""
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def on_success(self):
+        """Additively increase the limit after a run of successes."""
+        with self._cond:
+            self.successes += 1
+            if self.successes >= INCREASE_AFTER:
+                self.successes = 0
+                if self.limit < self.max_limit:
+                    self.limit += 1
+                    self._cond.notify_all()
+
+    def on_throttle(self):
+        """Multiplicatively decrease the limit when the API pushes back."""
+        with self._cond:
+            self.successes = 0
+            self.limit = max(1, int(self.limit * 0.5))
+
+
+class RateLimiter:
+    """
+    Client-side sliding-window limiter capping requests per minute.
+
+    Keeps the send times of the last minute's requests and blocks once the
+    window is full, so we stay under the server quota instead of tripping it.
+    """
+
+    def __init__(self, rpm: int):
+        self.rpm = rpm
+        self.times = collections.deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until another request fits in the current window."""
+        with self._lock:
+            now = time.monotonic()
+            while self.times and now - self.times[0] >= 60:
+                self.times.popleft()
+            if len(self.times) >= self.rpm:
+                time.sleep(60 - (now - self.times[0]))
+                self.times.popleft()
+            self.times.append(time.monotonic())
+
+
+def set_rate_limit(rpm: int):
+    """Cap all subsequent API requests at rpm requests per minute."""
+    global RATE_LIMITER
+    RATE_LIMITER = RateLimiter(rpm)
+
+
+def get_retry_delay(response: requests.Response, attempt: int) -> float:
+    """
+    Work out how long to wait before retrying a throttled request.
+
+    Honors a numeric Retry-After header, otherwise uses capped exponential
+    backoff with jitter.
+    """
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return min(BACKOFF_CAP, float(retry_after))
+        except ValueError:
+            pass  # HTTP-date form, fall back to exponential backoff
+    delay = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)
+    return delay + random.uniform(0, delay)
+
+
+def send_with_retry(
+    session: requests.Session,
+    method: str,
+    url: str,
+    controller: Optional[AdaptiveConcurrency] = None,
+    **kwargs
+) -> requests.Response:
+    """
+    Send a request, backing off and retrying when the API rate-limits us.
+
+    Once any request is throttled, all threads send one request at a time
+    until one succeeds, so retries don't pile onto an exhausted quota.
+
+    Args:
+        session: Shared HTTP session
+        method: HTTP method (e.g. "GET", "POST", "DELETE")
+        url: Request URL
+        controller: Optional AIMD controller to report throttling/successes to
+        **kwargs: Passed through to session.request
+
+    Returns:
+        The final response (callers still call raise_for_status)
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        if RATE_LIMITER is not None:
+            RATE_LIMITER.acquire()
+        if THROTTLED.is_set():
+            with THROTTLE_LOCK:
+                response = session.request(method, url, **kwargs)
+        else:
+            response = session.request(method, url, **kwargs)
+
+        if response.status_code not in RETRY_STATUSES:
+            if response.ok:
+                THROTTLED.clear()
+            break
+
+        THROTTLED.set()
+        if controller is not None:
+            controller.on_throttle()
+        if attempt < MAX_ATTEMPTS - 1:
+            delay = get_retry_delay(response, attempt)
+            print(f"  Rate limited ({response.status_code}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+    if controller is not None and response.ok:
+        if response.headers.get("x-ratelimit-remaining-requests") == "0":
+            controller.on_throttle()
+        else:
+            controller.on_success()
+
+    return response
+
+
+def json_body(payload: dict) -> dict:
+    """Request kwargs for a JSON body, pre-encoded to bytes with orjson if available."""
+    if orjson is not None:
+        return {"data": orjson.dumps(payload)}
+    return {"json": payload}
+
+
+def parse_json(response: requests.Response):
+    """Decode a JSON response body, with orjson if available."""
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+
+def iter_emails_from_csv(
+    csv_path: str,
+    email_column: Optional[str] = None,
+    validate: bool = True
+) -> Iterator[str]:
+    """
+    Stream email addresses from a CSV file one row at a time.
+
+    Args:
+        csv_path: Path to the CSV file (gzip-compressed if it ends in .gz)
+        email_column: Optional column name containing emails.
+                      If not provided, tries common column names or uses first column.
+        validate: Skip values that don't look like email addresses (default: True).
+                  Invite dry runs turn this off to show exactly what the column holds.
+
+    Yields:
+        Email addresses, in file order
+    """
+    if csv_path.endswith(".gz"):
+        f = gzip.open(csv_path, "rt", newline="", encoding="utf-8")
+    else:
+        f = open(csv_path, "r", newline="", encoding="utf-8")
+
+    with f:
+        reader = csv.reader(f)
+        fieldnames = next(reader, None)
+        if not fieldnames:
+            return
+
+        # Determine which column contains emails
+        if email_column and email_column in fieldnames:
+            col_idx = fieldnames.index(email_column)
+        else:
+            # Try to find email column automatically
+            normalized = {}
+            for idx, name in enumerate(fieldnames):
+                key = "".join(ch for ch in name.lower() if ch.isalnum())
+                normalized.setdefault(key, idx)
+            col_idx = next(
+                (normalized[name] for name in EMAIL_COLUMN_NAMES if name in normalized),
+                None
+            )
+
+            if col_idx is None:
+                # Fall back to first column
+                col_idx = 0
+                print(f"Warning: Using first column '{fieldnames[0]}' for emails")
+
+        print(f"Reading emails from column: '{fieldnames[col_idx]}'")
+
+        # Bind the matcher locally to skip the global/attribute lookup per row
+        match_email = EMAIL_RE.match
+        for row in reader:
+            if col_idx >= len(row):
+                continue
+            email = row[col_idx].strip()
+            if not validate:
+                if email:
+                    yield email
+            # Cheap substring prefilter before the full regex, so malformed
+            # addresses are dropped here rather than costing an API call
+            elif "@" in email and "." in email.rsplit("@", 1)[-1] and match_email(email):
+                yield email
+
+
+def write_ndjson(out: TextIO, email: str, status: str, error: Optional[str] = None):
+    """Write one result as a JSON line and flush it straight away."""
+    record = {"email": email, "status": status}
+    if error is not None:
+        record["error"] = error
+    out.write(json.dumps(record) + "\n")
+    out.flush()
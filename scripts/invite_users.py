@@ -10,98 +10,49 @@ Usage:
 
 Requirements:
     pip install requests python-dotenv
+    pip install orjson  # optional, faster JSON encoding/decoding
 
 Environment Variables:
     CONTEXTUAL_API_KEY - Your Contextual AI API key (admin required)
 """
 
 import argparse
-import csv
+import itertools
 import os
 import sys
-from typing import Optional
-
-try:
-    import requests
-except ImportError:
-    print("Error: requests library required. Install with: pip install requests")
-    sys.exit(1)
-
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-    pass  # dotenv is optional
-
-
-API_BASE_URL = "https://api.contextual.ai/v1"
-
-
-def get_api_key() -> str:
-    """Get API key from environment variable."""
-    api_key = os.environ.get("CONTEXTUAL_API_KEY")
-    if not api_key:
-        print("Error: CONTEXTUAL_API_KEY environment variable not set")
-        print("Set it with: export CONTEXTUAL_API_KEY='your-key'")
-        sys.exit(1)
-    return api_key
-
-
-def read_emails_from_csv(csv_path: str, email_column: Optional[str] = None) -> list[str]:
-    """
-    Read email addresses from a CSV file.
-
-    Args:
-        csv_path: Path to the CSV file
-        email_column: Optional column name containing emails.
-                      If not provided, tries common column names or uses first column.
-
-    Returns:
-        List of email addresses
-    """
-    emails = []
-    common_email_columns = [
-        "email", "Email", "EMAIL",
-        "email address", "Email Address", "Email address",
-        "emailaddress", "EmailAddress",
-        "e-mail", "E-mail", "E-Mail"
-    ]
-
-    with open(csv_path, "r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-
-        # Determine which column contains emails
-        if email_column and email_column in reader.fieldnames:
-            col = email_column
-        else:
-            # Try to find email column automatically
-            col = None
-            for name in common_email_columns:
-                if name in reader.fieldnames:
-                    col = name
-                    break
-
-            if col is None:
-                # Fall back to first column
-                col = reader.fieldnames[0]
-                print(f"Warning: Using first column '{col}' for emails")
-
-        print(f"Reading emails from column: '{col}'")
-
-        for row in reader:
-            email = row.get(col, "").strip()
-            if email and "@" in email:
-                emails.append(email)
-
-    return emails
+from typing import Iterable, Iterator, Optional, TextIO
+
+from _common import (
+    API_BASE_URL,
+    get_api_key,
+    get_session,
+    iter_emails_from_csv,
+    json_body,
+    parse_json,
+    requests,
+    send_with_retry,
+    set_rate_limit,
+    write_ndjson,
+)
+
+
+def unique_emails(emails: Iterable[str]) -> Iterator[str]:
+    """Normalize emails to lowercase and drop duplicates, preserving order."""
+    seen = set()
+    for email in emails:
+        email = email.strip().lower()
+        if email and email not in seen:
+            seen.add(email)
+            yield email
 
 
 def invite_users(
     api_key: str,
     tenant_short_name: str,
-    emails: list[str],
+    emails: Iterable[str],
     is_admin: bool = False,
-    batch_size: int = 50
+    batch_size: int = 50,
+    ndjson_out: Optional[TextIO] = None
 ) -> dict:
     """
     Invite users to a Contextual AI tenant.
@@ -109,63 +60,86 @@ def invite_users(
     Args:
         api_key: Contextual AI API key
         tenant_short_name: The tenant's short name
-        emails: List of email addresses to invite
+        emails: Email addresses to invite; consumed lazily one batch at a time,
+                so a generator from iter_emails_from_csv is never fully buffered.
+                Addresses are lowercased and duplicates skipped.
         is_admin: Whether to grant admin privileges (default: False)
         batch_size: Number of users to invite per request (default: 50)
+        ndjson_out: Optional stream to write each result to as a JSON line as
+                    soon as its batch resolves; results are then not retained
 
     Returns:
-        Dict with 'invited' and 'errors' keys
+        Dict with 'invited' and 'errors' keys (empty when streaming to
+        ndjson_out) and 'invited_count' / 'error_count' totals
     """
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
+    session = get_session(api_key)
 
     all_invited = []
     all_errors = {}
+    counts = {"invited": 0, "error": 0}
 
-    # Process in batches
-    for i in range(0, len(emails), batch_size):
-        batch = emails[i:i + batch_size]
-        print(f"Processing batch {i // batch_size + 1} ({len(batch)} users)...")
+    def record_invited(email: str):
+        counts["invited"] += 1
+        if ndjson_out is not None:
+            write_ndjson(ndjson_out, email, "invited")
+        else:
+            all_invited.append(email)
+
+    def record_error(email: str, error: str):
+        counts["error"] += 1
+        if ndjson_out is not None:
+            write_ndjson(ndjson_out, email, "error", error)
+        else:
+            all_errors[email] = error
+
+    # Fields shared by every invite, built once rather than per user/batch
+    user_flags = {"is_tenant_admin": is_admin}
+
+    # Process in batches, pulling each one from the (possibly lazy) source.
+    # Duplicates are dropped first so they don't waste batch slots.
+    emails = unique_emails(emails)
+    for batch_num in itertools.count(1):
+        batch = list(itertools.islice(emails, batch_size))
+        if not batch:
+            break
+        print(f"Processing batch {batch_num} ({len(batch)} users)...")
 
         payload = {
             "tenant_short_name": tenant_short_name,
-            "new_users": [
-                {
-                    "email": email,
-                    "is_tenant_admin": is_admin
-                }
-                for email in batch
-            ]
+            "new_users": [{"email": email, **user_flags} for email in batch]
         }
 
         try:
-            response = requests.post(
+            response = send_with_retry(
+                session,
+                "POST",
                 f"{API_BASE_URL}/users",
-                headers=headers,
-                json=payload
+                **json_body(payload)
             )
             response.raise_for_status()
 
-            data = response.json()
-            all_invited.extend(data.get("invited_user_emails", []))
-            all_errors.update(data.get("errors", {}))
+            data = parse_json(response)
+            for email in data.get("invited_user_emails", []):
+                record_invited(email)
+            for email, error in data.get("errors", {}).items():
+                record_error(email, str(error))
 
         except requests.exceptions.HTTPError as e:
             print(f"HTTP Error: {e}")
             print(f"Response: {response.text}")
             # Add all batch emails to errors
             for email in batch:
-                all_errors[email] = str(e)
+                record_error(email, str(e))
         except Exception as e:
             print(f"Error: {e}")
             for email in batch:
-                all_errors[email] = str(e)
+                record_error(email, str(e))
 
     return {
         "invited": all_invited,
-        "errors": all_errors
+        "errors": all_errors,
+        "invited_count": counts["invited"],
+        "error_count": counts["error"]
     }
 
 
@@ -197,26 +171,55 @@ def main():
         action="store_true",
         help="Print emails without actually inviting"
     )
+    parser.add_argument(
+        "--rate-per-minute", "-r",
+        type=int,
+        help="Maximum API requests per minute (unlimited if not provided)"
+    )
+    parser.add_argument(
+        "--output", "-o",
+        choices=["text", "ndjson"],
+        default="text",
+        help="Result format: a text report at the end, or one JSON line per "
+             "email on stdout as results arrive (progress goes to stderr)"
+    )
 
     args = parser.parse_args()
 
+    if args.rate_per_minute is not None:
+        if args.rate_per_minute < 1:
+            print("Error: --rate-per-minute must be at least 1")
+            sys.exit(1)
+        set_rate_limit(args.rate_per_minute)
+
+    # In NDJSON mode stdout carries only result lines; progress goes to stderr
+    ndjson_out = None
+    if args.output == "ndjson":
+        ndjson_out = sys.stdout
+        sys.stdout = sys.stderr
+
     # Read emails from CSV
     if not os.path.exists(args.csv):
         print(f"Error: CSV file not found: {args.csv}")
         sys.exit(1)
 
-    emails = read_emails_from_csv(args.csv, args.email_column)
+    emails = iter_emails_from_csv(args.csv, args.email_column, validate=not args.dry_run)
 
-    if not emails:
+    first_email = next(emails, None)
+    if first_email is None:
         print("No valid email addresses found in CSV")
         sys.exit(1)
-
-    print(f"Found {len(emails)} email(s) to invite")
+    emails = itertools.chain([first_email], emails)
 
     if args.dry_run:
-        print("\n[DRY RUN] Would invite these users:")
-        for email in emails:
+        # Same lowercasing/dedupe as invite_users(), so duplicates are counted once
+        print("\n[DRY RUN] Values in the email column, lowercased with duplicates merged "
+              "(invalid addresses are skipped on a real run):")
+        count = 0
+        for email in unique_emails(emails):
             print(f"  - {email}")
+            count += 1
+        print(f"\nFound {count} unique value(s) in the email column")
         return
 
     # Get API key and invite users
@@ -230,9 +233,14 @@ def main():
         api_key=api_key,
         tenant_short_name=args.tenant,
         emails=emails,
-        is_admin=args.admin
+        is_admin=args.admin,
+        ndjson_out=ndjson_out
     )
 
+    if ndjson_out is not None:
+        print(f"Total: {result['invited_count']} invited, {result['error_count']} errors")
+        return
+
     # Print results
     print(f"\n{'='*50}")
     print("RESULTS")
@@ -17,115 +17,95 @@ Usage:
 
 Requirements:
     pip install requests python-dotenv
+    pip install orjson  # optional, faster JSON encoding/decoding
 
 Environment Variables:
     CONTEXTUAL_API_KEY - Your Contextual AI API key (admin required)
 """
 
 import argparse
-import csv
 import os
 import sys
-from typing import Optional
-
-try:
-    import requests
-except ImportError:
-    print("Error: requests library required. Install with: pip install requests")
-    sys.exit(1)
-
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-    pass  # dotenv is optional
-
-
-API_BASE_URL = "https://api.contextual.ai/v1"
-
-
-def get_api_key() -> str:
-    """Get API key from environment variable."""
-    api_key = os.environ.get("CONTEXTUAL_API_KEY")
-    if not api_key:
-        print("Error: CONTEXTUAL_API_KEY environment variable not set")
-        print("Set it with: export CONTEXTUAL_API_KEY='your-key'")
-        sys.exit(1)
-    return api_key
-
-
-def read_emails_from_csv(csv_path: str, email_column: Optional[str] = None) -> list[str]:
-    """
-    Read email addresses from a CSV file.
-
-    Args:
-        csv_path: Path to the CSV file
-        email_column: Optional column name containing emails.
-                      If not provided, tries common column names or uses first column.
-
-    Returns:
-        List of email addresses
-    """
-    emails = []
-    common_email_columns = [
-        "email", "Email", "EMAIL",
-        "email address", "Email Address", "Email address",
-        "emailaddress", "EmailAddress",
-        "e-mail", "E-mail", "E-Mail"
-    ]
-
-    with open(csv_path, "r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-
-        # Determine which column contains emails
-        if email_column and email_column in reader.fieldnames:
-            col = email_column
-        else:
-            # Try to find email column automatically
-            col = None
-            for name in common_email_columns:
-                if name in reader.fieldnames:
-                    col = name
-                    break
-
-            if col is None:
-                # Fall back to first column
-                col = reader.fieldnames[0]
-                print(f"Warning: Using first column '{col}' for emails")
-
-        print(f"Reading emails from column: '{col}'")
-
-        for row in reader:
-            email = row.get(col, "").strip()
-            if email and "@" in email:
-                emails.append(email.lower())
-
-    return emails
-
-
-def list_tenant_users(api_key: str) -> list[dict]:
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, TextIO
+
+from _common import (
+    API_BASE_URL,
+    POOL_MAXSIZE,
+    AdaptiveConcurrency,
+    get_api_key,
+    get_session,
+    iter_emails_from_csv,
+    parse_json,
+    requests,
+    send_with_retry,
+    set_rate_limit,
+    write_ndjson,
+)
+
+
+MAX_WORKERS = 8
+# Safety cap on /users pages so a misbehaving cursor can't loop forever
+MAX_USERS_PAGES = 1000
+
+# Full /users listings keyed by API key, the same key get_session() keeps
+# its sessions under, so a cached listing always belongs to the tenant whose
+# credentials fetched it
+USERS_CACHE: dict[str, list[dict]] = {}
+
+
+def list_tenant_users(api_key: str, page_size: Optional[int] = None) -> list[dict]:
     """
     List all users in a tenant (determined by API key).
 
+    Follows the API's cursor pagination, and caches the result per API key
+    so repeated calls within one run don't refetch the whole tenant.
+
     Args:
         api_key: Contextual AI API key
+        page_size: Number of users to request per page (default: server's choice)
 
     Returns:
         List of user dicts with 'id', 'email', 'is_tenant_admin' keys
     """
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
+    if api_key in USERS_CACHE:
+        return USERS_CACHE[api_key]
+
+    session = get_session(api_key)
+    users = []
+    cursor = None
+    seen_cursors = set()
 
     try:
-        response = requests.get(
-            f"{API_BASE_URL}/users",
-            headers=headers
-        )
-        response.raise_for_status()
-        data = response.json()
-        return data.get("users", [])
+        for _ in range(MAX_USERS_PAGES):
+            params = {}
+            if page_size is not None:
+                params["limit"] = page_size
+            if cursor:
+                params["cursor"] = cursor
+            response = send_with_retry(
+                session,
+                "GET",
+                f"{API_BASE_URL}/users",
+                params=params
+            )
+            response.raise_for_status()
+            data = parse_json(response)
+            users.extend(data.get("users", []))
+
+            cursor = data.get("next_cursor")
+            if not cursor:
+                break
+            if cursor in seen_cursors:
+                print(f"Error listing users: API returned cursor {cursor!r} twice")
+                return []
+            seen_cursors.add(cursor)
+        else:
+            print(f"Error listing users: still paging after {MAX_USERS_PAGES} pages")
+            return []
+
+        USERS_CACHE[api_key] = users
+        return users
     except requests.exceptions.HTTPError as e:
         print(f"HTTP Error listing users: {e}")
         print(f"Response: {response.text}")
@@ -135,26 +115,34 @@ def list_tenant_users(api_key: str) -> list[dict]:
         return []
 
 
-def remove_user(api_key: str, email: str) -> bool:
+def remove_user(
+    api_key: str,
+    email: str,
+    controller: Optional[AdaptiveConcurrency] = None
+) -> bool:
     """
     Remove a single user from a tenant.
 
+    The DELETE /users endpoint only accepts one email per request (unlike
+    the invite endpoint's new_users array), so bulk removals go through
+    remove_user_emails() which runs these calls concurrently.
+
     Args:
         api_key: Contextual AI API key
         email: The user's email to remove
+        controller: Optional AIMD controller shared by concurrent removals
 
     Returns:
         True if successful, False otherwise
     """
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
+    session = get_session(api_key)
 
     try:
-        response = requests.delete(
+        response = send_with_retry(
+            session,
+            "DELETE",
             f"{API_BASE_URL}/users",
-            headers=headers,
+            controller=controller,
             json={"email": email}
         )
         response.raise_for_status()
@@ -167,10 +155,60 @@ def remove_user(api_key: str, email: str) -> bool:
         return False
 
 
+def remove_user_emails(
+    api_key: str,
+    emails: list[str],
+    max_workers: int = MAX_WORKERS,
+    ndjson_out: Optional[TextIO] = None
+) -> tuple[list[str], list[str]]:
+    """
+    Remove several users concurrently with a bounded thread pool.
+
+    The number of requests actually in flight adapts between 1 and
+    max_workers depending on whether the API is rate-limiting us.
+
+    Args:
+        api_key: Contextual AI API key
+        emails: Email addresses of the users to remove
+        max_workers: Maximum number of DELETE requests in flight (default: 8)
+        ndjson_out: Optional stream to write each result to as a JSON line as
+                    soon as its request completes
+
+    Returns:
+        Tuple of (removed emails, errored emails)
+    """
+    removed = []
+    errors = []
+    controller = AdaptiveConcurrency(max_workers)
+
+    def remove_with_slot(email: str) -> bool:
+        with controller.slot():
+            print(f"  Removing: {email}...")
+            return remove_user(api_key, email, controller)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(remove_with_slot, email): email for email in emails}
+
+        for future in as_completed(futures):
+            email = futures[future]
+            if future.result():
+                removed.append(email)
+                status = "removed"
+            else:
+                errors.append(email)
+                status = "error"
+            if ndjson_out is not None:
+                write_ndjson(ndjson_out, email, status)
+
+    return removed, errors
+
+
 def remove_users(
     api_key: str,
     emails_to_remove: list[str],
-    exclude_admins: bool = True
+    exclude_admins: bool = True,
+    max_workers: int = MAX_WORKERS,
+    ndjson_out: Optional[TextIO] = None
 ) -> dict:
     """
     Remove users from a Contextual AI tenant.
@@ -179,12 +217,15 @@ def remove_users(
         api_key: Contextual AI API key
         emails_to_remove: List of email addresses to remove
         exclude_admins: Skip admin users even if in the list (default: True)
+        max_workers: Maximum number of concurrent DELETE requests (default: 8)
+        ndjson_out: Optional stream to write each result to as a JSON line
 
     Returns:
-        Dict with 'removed', 'skipped', and 'errors' keys
+        Dict with 'removed', 'skipped', and 'errors' keys ('errors' also
+        lists emails that are not in the tenant)
     """
-    # Normalize emails to lowercase for comparison
-    emails_to_remove = [e.lower() for e in emails_to_remove]
+    # Normalize emails to lowercase and dedupe, keeping input order
+    emails_to_remove = dict.fromkeys(e.strip().lower() for e in emails_to_remove if e)
 
     # Get current users
     print("Fetching current tenant users...")
@@ -196,27 +237,34 @@ def remove_users(
 
     print(f"Found {len(users)} users in tenant")
 
-    removed = []
+    # Index tenant users by email so each requested email is a dict lookup
+    users_by_email = {user.get("email", "").lower(): user for user in users}
+
+    targets = []
     skipped = []
-    errors = []
+    not_found = []
 
-    for user in users:
-        user_email = user.get("email", "").lower()
-        is_admin = user.get("is_tenant_admin", False)
+    for user_email in emails_to_remove:
+        user = users_by_email.get(user_email)
 
-        if user_email not in emails_to_remove:
+        if user is None:
+            print(f"  Not in tenant: {user_email}")
+            not_found.append(user_email)
+            if ndjson_out is not None:
+                write_ndjson(ndjson_out, user_email, "error", "not in tenant")
             continue
 
-        if exclude_admins and is_admin:
+        if exclude_admins and user.get("is_tenant_admin", False):
             print(f"  Skipping admin: {user_email}")
             skipped.append(user_email)
+            if ndjson_out is not None:
+                write_ndjson(ndjson_out, user_email, "skipped")
             continue
 
-        print(f"  Removing: {user_email}...")
-        if remove_user(api_key, user_email):
-            removed.append(user_email)
-        else:
-            errors.append(user_email)
+        targets.append(user_email)
+
+    removed, errors = remove_user_emails(api_key, targets, max_workers, ndjson_out)
+    errors.extend(not_found)
 
     return {
         "removed": removed,
@@ -225,12 +273,18 @@ def remove_users(
     }
 
 
-def remove_all_non_admin_users(api_key: str) -> dict:
+def remove_all_non_admin_users(
+    api_key: str,
+    max_workers: int = MAX_WORKERS,
+    ndjson_out: Optional[TextIO] = None
+) -> dict:
     """
     Remove all non-admin users from a tenant.
 
     Args:
         api_key: Contextual AI API key
+        max_workers: Maximum number of concurrent DELETE requests (default: 8)
+        ndjson_out: Optional stream to write each result to as a JSON line
 
     Returns:
         Dict with 'removed' and 'errors' keys
@@ -246,17 +300,12 @@ def remove_all_non_admin_users(api_key: str) -> dict:
     non_admin_users = [u for u in users if not u.get("is_tenant_admin", False)]
     print(f"Found {len(non_admin_users)} non-admin users to remove")
 
-    removed = []
-    errors = []
-
-    for user in non_admin_users:
-        user_email = user.get("email", "")
-
-        print(f"  Removing: {user_email}...")
-        if remove_user(api_key, user_email):
-            removed.append(user_email)
-        else:
-            errors.append(user_email)
+    removed, errors = remove_user_emails(
+        api_key,
+        [u.get("email", "") for u in non_admin_users],
+        max_workers,
+        ndjson_out
+    )
 
     return {
         "removed": removed,
@@ -300,9 +349,39 @@ def main():
         action="store_true",
         help="Skip confirmation prompts"
     )
+    parser.add_argument(
+        "--workers", "-w",
+        type=int,
+        default=MAX_WORKERS,
+        help=f"Number of users to remove concurrently (default: {MAX_WORKERS}, max: {POOL_MAXSIZE})"
+    )
+    parser.add_argument(
+        "--rate-per-minute", "-r",
+        type=int,
+        help="Maximum API requests per minute (unlimited if not provided)"
+    )
+    parser.add_argument(
+        "--output", "-o",
+        choices=["text", "ndjson"],
+        default="text",
+        help="Result format: a text report at the end, or one JSON line per "
+             "email on stdout as results arrive (progress goes to stderr)"
+    )
 
     args = parser.parse_args()
 
+    if args.rate_per_minute is not None:
+        if args.rate_per_minute < 1:
+            print("Error: --rate-per-minute must be at least 1")
+            sys.exit(1)
+        set_rate_limit(args.rate_per_minute)
+
+    # In NDJSON mode stdout carries only result lines; progress goes to stderr
+    ndjson_out = None
+    if args.output == "ndjson":
+        ndjson_out = sys.stdout
+        sys.stdout = sys.stderr
+
     # Validate arguments
     if not args.csv and not args.all_users:
         print("Error: Must provide either --csv or --all-users")
@@ -312,10 +391,13 @@ def main():
         print("Error: Cannot use both --csv and --all-users")
         sys.exit(1)
 
-    api_key = get_api_key()
+    if not 1 <= args.workers <= POOL_MAXSIZE:
+        print(f"Error: --workers must be between 1 and {POOL_MAXSIZE}")
+        sys.exit(1)
 
     if args.all_users:
         # Remove all non-admin users
+        api_key = get_api_key()
         print(f"\nWARNING: This will remove ALL non-admin users from the tenant")
 
         if not args.yes:
@@ -333,7 +415,7 @@ def main():
                 print(f"  - {user.get('email')}")
             return
 
-        result = remove_all_non_admin_users(api_key)
+        result = remove_all_non_admin_users(api_key, args.workers, ndjson_out)
         result["skipped"] = []  # No skipped for all-users mode
 
     else:
@@ -342,7 +424,7 @@ def main():
             print(f"Error: CSV file not found: {args.csv}")
             sys.exit(1)
 
-        emails = read_emails_from_csv(args.csv, args.email_column)
+        emails = list(iter_emails_from_csv(args.csv, args.email_column))
 
         if not emails:
             print("No valid email addresses found in CSV")
@@ -350,12 +432,15 @@ def main():
 
         print(f"Found {len(emails)} email(s) to remove")
 
+        # CSV dry runs never touch the API, so no key is needed
         if args.dry_run:
             print("\n[DRY RUN] Would remove these users:")
             for email in emails:
                 print(f"  - {email}")
             return
 
+        api_key = get_api_key()
+
         if not args.yes:
             print(f"\nThis will remove {len(emails)} users from the tenant")
             confirm = input("Continue? (y/n): ")
@@ -366,9 +451,15 @@ def main():
         result = remove_users(
             api_key=api_key,
             emails_to_remove=emails,
-            exclude_admins=not args.include_admins
+            exclude_admins=not args.include_admins,
+            max_workers=args.workers,
+            ndjson_out=ndjson_out
         )
 
+    if ndjson_out is not None:
+        print(f"Total: {len(result['removed'])} removed, {len(result.get('skipped', []))} skipped, {len(result['errors'])} errors")
+        return
+
     # Print results
     print(f"\n{'='*50}")
     print("RESULTS")